@@ -1,11 +1,24 @@
 import os
+import shutil
+import time
+import random
+import threading
 import asyncio
 import aiohttp
-from datetime import datetime
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
+import re
 import json
 import logging
+from dataclasses import dataclass
+from functools import lru_cache
+from collections import OrderedDict
+from itertools import islice
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -16,79 +29,391 @@ logger = logging.getLogger(__name__)
 # Kaspa API endpoints
 KASPA_API_BASE = "https://api.kas.fyi/v1"  # Correct API!
 KASPA_EXPLORER_URL = "https://explorer.kaspa.org"
+# Optional push stream; when unset the bot relies on polling only
+KASPA_WS_URL = os.getenv('KASPA_WS_URL')
+
+WELCOME_MESSAGE = (
+    "🚀 *Welcome to Kaspa Wallet Monitor Bot!*\n\n"
+    "This bot monitors your Kaspa wallet addresses and notifies you "
+    "of incoming transactions.\n\n"
+    "Use the buttons below to get started!"
+)
+HELP_TEXT = (
+    "📖 *Kaspa Wallet Monitor - Help*\n\n"
+    "*Commands:*\n"
+    "/start - Start the bot\n"
+    "/add <address> - Add wallet address\n"
+    "/list - List monitored wallets\n"
+    "/remove <address> - Remove wallet\n\n"
+    "*Address Format:*\n"
+    "kaspa:qz7ulu4c25dh7fzec..."
+)
+_KB = [
+    [KeyboardButton("📝 Add Wallet"), KeyboardButton("📋 List Wallets")],
+    [KeyboardButton("❌ Remove Wallet"), KeyboardButton("ℹ️ Help")]
+]
+REPLY_MARKUP = ReplyKeyboardMarkup(_KB, resize_keyboard=True)
+
+_KASPA_PREFIX = 'kaspa:'
+# Bech32 payload: 61 chars for Schnorr/P2SH addresses, 63 for ECDSA
+KASPA_RE = re.compile(r'^kaspa:[qpzry9x8gf2tvdw0s3jn54khce6mua7l]{61,63}$')
+
+@lru_cache(maxsize=1024)
+def is_valid_kaspa(address):
+    return KASPA_RE.match(address) is not None
+
+@lru_cache(maxsize=4096)
+def short_address(address):
+    if len(address) <= 30:
+        return address
+    return f"{address[:15]}...{address[-10:]}"
+
+def tx_key(tx_hash):
+    # Tx ids are already uniform 256-bit hashes, so the first 64 bits make a
+    # compact dedup key; non-hex ids (and stored int keys) pass through
+    if isinstance(tx_hash, str):
+        try:
+            return int(tx_hash[:16], 16)
+        except ValueError:
+            pass
+    return tx_hash
+
+SOMPI_PER_KAS = 100_000_000
+
+_TX_DETAILS_TMPL = (
+    "💰 *Amount:* `{amount_kas:.8f}` KAS\n"
+    "⏰ *Time:* {tx_time}\n"
+    "📤 *From:* `{from_short}`\n"
+    "📥 *To:* `{to_short}`\n"
+    "🔗 *TX:* `{tx_prefix}...`\n\n"
+    "[View on Explorer](" + KASPA_EXPLORER_URL + "/txs/{tx_hash})"
+)
+_INCOMING_TMPL = "🔔 *📥 Incoming Transaction!*\n\n" + _TX_DETAILS_TMPL
+_OUTGOING_TMPL = "🔔 *📤 Outgoing Transaction!*\n\n" + _TX_DETAILS_TMPL
+
+# Transactions requested per poll, and when seeding a newly added wallet
+POLL_TX_LIMIT = 20
+HISTORY_TX_LIMIT = 50
+
+# Bodies larger than this are parsed in a worker thread to keep the loop free
+JSON_OFFLOAD_BYTES = 64 * 1024
+
+# Returned by check_transactions when the API answers 304 to a poll's ETag
+NOT_MODIFIED = object()
+
+# Notified tx hashes remembered per wallet
+MAX_NOTIFIED_PER_WALLET = 1000
+
+# Seconds between flushes of pending state changes to disk
+SAVE_INTERVAL = 5
+
+# Notified-tx journal entries to accumulate before compacting into the snapshot
+JOURNAL_COMPACT_EVERY = 1000
+
+# Fail fast on connect, leave most of the budget for reading the response
+REQ_TIMEOUT = aiohttp.ClientTimeout(total=10, connect=3, sock_read=7)
+# Tries per API fetch, with exponential backoff plus jitter in between
+FETCH_ATTEMPTS = 3
+
+# Max wallets checked concurrently per monitoring cycle
+MAX_CONCURRENT_CHECKS = 10
+
+# Stay under Telegram's global limit of 30 messages per second
+TELEGRAM_MAX_MSG_PER_SEC = 28
+
+# Telegram caps messages at 4096 UTF-16 units; emoji take two, so keep headroom
+TELEGRAM_MAX_MESSAGE_LEN = 4000
+NOTIFICATION_SEPARATOR = "\n\n───\n\n"
+
+# Idle wallets back off from POLL_INTERVAL up to MAX_POLL_INTERVAL seconds;
+# a wallet that just had activity is re-checked after ACTIVE_POLL_INTERVAL
+POLL_INTERVAL = 15
+ACTIVE_POLL_INTERVAL = 5
+MAX_POLL_INTERVAL = 300
+
+def json_loads(data):
+    return orjson.loads(data) if orjson else json.loads(data)
+
+def json_dumps(obj):
+    if orjson:
+        return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(obj).encode()
+
+def json_dumps_str(obj):
+    return json_dumps(obj).decode()
+
+@dataclass
+class Tx:
+    __slots__ = ('id', 'block_time', 'inputs', 'outputs')
+    id: str
+    block_time: int
+    inputs: list   # sender address per input
+    outputs: list  # (address, amount in sompi) per output
+
+def _parse_tx(raw):
+    # The one place raw API entries are checked; malformed parts are dropped
+    inputs = []
+    for inp in raw.get('inputs') or ():
+        prev = inp.get('previousOutput') if isinstance(inp, dict) else None
+        inputs.append(prev.get('address', 'Unknown') if isinstance(prev, dict) else 'Unknown')
+    outputs = []
+    for out in raw.get('outputs') or ():
+        if isinstance(out, dict):
+            prev = out.get('previousOutput') or {}
+            outputs.append((out.get('address', 'Unknown'), int(prev.get('amount', 0))))
+    return Tx(raw['transactionId'], int(raw.get('blockTime') or 0), inputs, outputs)
+
+def classify_tx(tx: Tx, wallet: str) -> tuple[bool, int, str, str]:
+    # Direction, amount in sompi, from and to address, in one pass over outputs
+    is_incoming = False
+    incoming_total = 0
+    outgoing_total = 0
+    for address, amt in tx.outputs:
+        if address == wallet:
+            is_incoming = True
+            incoming_total += amt
+        else:
+            outgoing_total += amt
+    
+    if is_incoming:
+        return True, incoming_total, tx.inputs[0] if tx.inputs else "Unknown", wallet
+    if wallet in tx.inputs:
+        return False, outgoing_total, wallet, tx.outputs[0][0]
+    return False, 0, "Unknown", "Unknown"
+
+def parse_transactions(data):
+    raw_list = data.get('transactions') if isinstance(data, dict) else None
+    txs = []
+    for raw in raw_list or ():
+        if not isinstance(raw, dict) or not raw.get('transactionId'):
+            continue
+        try:
+            txs.append(_parse_tx(raw))
+        except (TypeError, ValueError, AttributeError) as e:
+            logger.warning("⚠️ Skipping malformed tx %s: %s", raw['transactionId'], e)
+    return txs
+
+def decode_transactions(body):
+    return parse_transactions(json_loads(body))
 
 class KaspaBot:
     def __init__(self, token):
         self.token = token
+        self._tg_url = f"https://api.telegram.org/bot{token}/sendMessage"
         self.wallets = {}
+        self.addr_to_chats = {}
         self.notified_transactions = {}
+        self.last_checked = {}
+        self.last_top_tx = {}
+        self.next_check_at = {}
+        self.idle_count = {}
+        self.etags = {}
+        self._pending_etags = {}
+        self.api_params_supported = True
         self.data_file = "wallets_data.json"
-        self.load_wallets()
+        self.journal_file = self.data_file + ".log"
+        self._journal = None
+        self._journal_entries = 0
+        self.session = None
+        self.ws = None
+        self._dirty = False
+        self._tasks = []
+        self._push_tasks = set()
+        self._write_lock = threading.Lock()
+        self._tg_next_slot = 0.0
+        self._loaded = False
+        self._load_ok = False
+        self._load_lock = asyncio.Lock()
+        # Shared by the poll and push paths so the API sees one global cap
+        self._check_sem = asyncio.Semaphore(MAX_CONCURRENT_CHECKS)
+        self._inflight = {}
+        self._check_locks = {}
+        self._seeding = {}
+        self._button_handlers = {
+            "📝 Add Wallet": self.add_wallet_prompt,
+            "📋 List Wallets": self.list_wallets,
+            "❌ Remove Wallet": self.remove_wallet_prompt,
+            "ℹ️ Help": self.help_command
+        }
+    
+    async def _ensure_loaded(self):
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if not self._loaded:
+                self._load_ok = await asyncio.to_thread(self.load_wallets)
+                self._loaded = True
+    
+    def should_save_on_shutdown(self):
+        # After a failed load the in-memory state is empty; only write it
+        # out if something has actually changed since
+        return self._loaded and (self._load_ok or self._dirty)
     
     def load_wallets(self):
+        # Returns False when the state on disk could not be read
         try:
+            data = {}
             if os.path.exists(self.data_file):
-                with open(self.data_file, 'r') as f:
-                    data = json.load(f)
-                    self.wallets = {int(k): v for k, v in data.get('wallets', {}).items()}
-                    notified_data = data.get('notified_transactions', {})
-                    self.notified_transactions = {k: set(v) for k, v in notified_data.items()}
-                    logger.info(f"✅ Loaded {len(self.wallets)} wallets")
+                with open(self.data_file, 'rb') as f:
+                    data = json_loads(f.read())
+            self.wallets = {int(k): dict.fromkeys(v) for k, v in data.get('wallets', {}).items()}
+            notified_data = data.get('notified_transactions', {})
+            self.notified_transactions = {k: OrderedDict.fromkeys(map(tx_key, v)) for k, v in notified_data.items()}
+            self.last_checked = data.get('last_checked', {})
+            self.addr_to_chats = {}
+            for cid, addrs in self.wallets.items():
+                for addr in addrs:
+                    self.addr_to_chats.setdefault(addr, set()).add(cid)
+            replayed = self._replay_journal()
+            # Drop seen-sets left behind by addresses nobody watches any more
+            for addr in self.notified_transactions.keys() - self.addr_to_chats.keys():
+                del self.notified_transactions[addr]
+                self.last_checked.pop(addr, None)
+            logger.info("✅ Loaded %s wallets (%s journal entries)", len(self.wallets), replayed)
+            return True
         except Exception as e:
-            logger.error(f"Error loading: {e}")
+            logger.error("Error loading: %s", e)
             self.wallets = {}
+            self.addr_to_chats = {}
             self.notified_transactions = {}
+            self.last_checked = {}
+            self._quarantine_state()
+            return False
+    
+    def _quarantine_state(self):
+        # Move unreadable state aside so later saves can't overwrite it
+        for path in (self.data_file, self.journal_file + '.1', self.journal_file):
+            if os.path.exists(path):
+                try:
+                    os.replace(path, path + '.corrupt')
+                    logger.warning("⚠️ Moved unreadable %s to %s.corrupt", path, path)
+                except OSError as e:
+                    logger.error("Error moving %s aside: %s", path, e)
+    
+    def _replay_journal(self):
+        # Entries not yet folded into the snapshot: a rotated-out journal
+        # from an interrupted save first, then the live one
+        replayed = 0
+        for path in (self.journal_file + '.1', self.journal_file):
+            if not os.path.exists(path):
+                continue
+            with open(path, 'rb') as f:
+                for line in f:
+                    try:
+                        entry = json_loads(line)
+                        addr, key = entry['addr'], tx_key(entry['tx'])
+                    except ValueError:
+                        continue  # torn final line from a crash mid-append
+                    except (KeyError, TypeError):
+                        logger.warning("⚠️ Skipping malformed journal entry in %s", path)
+                        continue
+                    self._remember_tx(addr, key)
+                    replayed += 1
+        return replayed
+    
+    def _append_journal(self, wallet_address, key):
+        if self._journal is None:
+            self._journal = open(self.journal_file, 'ab', buffering=0)
+        self._journal.write(json_dumps({'addr': wallet_address, 'tx': key}) + b"\n")
+        self._journal_entries += 1
+        if self._journal_entries >= JOURNAL_COMPACT_EVERY:
+            self.schedule_save()
+    
+    def _rotate_journal(self):
+        # Runs on the loop together with serialization, so every entry is
+        # either in the snapshot being written or in the fresh journal
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if os.path.exists(self.journal_file):
+            rotated = self.journal_file + '.1'
+            if os.path.exists(rotated):
+                # The previous snapshot never landed, so its entries are not on
+                # disk anywhere else; append ours instead of replacing them.
+                # The leading newline closes off a torn final line.
+                with open(self.journal_file, 'rb') as src, open(rotated, 'ab') as dst:
+                    dst.write(b"\n")
+                    shutil.copyfileobj(src, dst)
+                os.remove(self.journal_file)
+            else:
+                os.replace(self.journal_file, rotated)
+        self._journal_entries = 0
+    
+    def _state_payload(self):
+        self._rotate_journal()
+        notified_data = {k: list(v) for k, v in self.notified_transactions.items()}
+        return json_dumps({
+            'wallets': {cid: list(addrs) for cid, addrs in self.wallets.items()},
+            'notified_transactions': notified_data,
+            'last_checked': self.last_checked
+        })
+    
+    def _write_state(self, payload):
+        # Write a temp file and rename it over the old state in one step;
+        # the lock keeps the shutdown save and a pending threaded save apart
+        tmp = self.data_file + '.tmp'
+        with self._write_lock:
+            with open(tmp, 'wb') as f:
+                f.write(payload)
+                # Make sure the data is on disk before the rename can expose it
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.data_file)
+            if os.path.exists(self.journal_file + '.1'):
+                os.remove(self.journal_file + '.1')
     
     def save_wallets(self):
         try:
-            notified_data = {k: list(v) for k, v in self.notified_transactions.items()}
-            with open(self.data_file, 'w') as f:
-                json.dump({'wallets': self.wallets, 'notified_transactions': notified_data}, f)
+            self._write_state(self._state_payload())
         except Exception as e:
-            logger.error(f"Error saving: {e}")
+            logger.error("Error saving: %s", e)
+    
+    def schedule_save(self):
+        # Picked up by _flusher; bursts of changes coalesce into one write
+        self._dirty = True
+    
+    async def _flusher(self):
+        while True:
+            await asyncio.sleep(SAVE_INTERVAL)
+            if not self._dirty:
+                continue
+            self._dirty = False
+            try:
+                # Serialize on the loop so the snapshot can't change mid-write
+                await asyncio.to_thread(self._write_state, self._state_payload())
+            except Exception as e:
+                logger.error("Error saving: %s", e)
+                self._dirty = True
     
     def is_transaction_notified(self, wallet_address, tx_hash):
-        if wallet_address not in self.notified_transactions:
-            self.notified_transactions[wallet_address] = set()
-        return tx_hash in self.notified_transactions[wallet_address]
+        return tx_key(tx_hash) in self.notified_transactions.get(wallet_address, ())
+    
+    def _remember_tx(self, wallet_address, key):
+        # Insertion-ordered, so the oldest key is evicted first in O(1)
+        seen = self.notified_transactions.setdefault(wallet_address, OrderedDict())
+        seen[key] = None
+        seen.move_to_end(key)
+        while len(seen) > MAX_NOTIFIED_PER_WALLET:
+            seen.popitem(last=False)
     
     def mark_transaction_notified(self, wallet_address, tx_hash):
-        if wallet_address not in self.notified_transactions:
-            self.notified_transactions[wallet_address] = set()
-        self.notified_transactions[wallet_address].add(tx_hash)
-        if len(self.notified_transactions[wallet_address]) > 1000:
-            sorted_txs = sorted(self.notified_transactions[wallet_address])
-            self.notified_transactions[wallet_address] = set(sorted_txs[-800:])
-        self.save_wallets()
+        # O(1) append instead of rewriting the whole state file per tx
+        key = tx_key(tx_hash)
+        self._remember_tx(wallet_address, key)
+        try:
+            self._append_journal(wallet_address, key)
+        except Exception as e:
+            logger.error("Error journaling: %s", e)
+            self.schedule_save()
     
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        keyboard = [
-            [KeyboardButton("📝 Add Wallet"), KeyboardButton("📋 List Wallets")],
-            [KeyboardButton("❌ Remove Wallet"), KeyboardButton("ℹ️ Help")]
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
-        welcome_message = (
-            "🚀 *Welcome to Kaspa Wallet Monitor Bot!*\n\n"
-            "This bot monitors your Kaspa wallet addresses and notifies you "
-            "of incoming transactions.\n\n"
-            "Use the buttons below to get started!"
-        )
-        await update.message.reply_text(welcome_message, parse_mode='Markdown', reply_markup=reply_markup)
+        await update.message.reply_text(WELCOME_MESSAGE, parse_mode='Markdown', reply_markup=REPLY_MARKUP)
     
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        help_text = (
-            "📖 *Kaspa Wallet Monitor - Help*\n\n"
-            "*Commands:*\n"
-            "/start - Start the bot\n"
-            "/add <address> - Add wallet address\n"
-            "/list - List monitored wallets\n"
-            "/remove <address> - Remove wallet\n\n"
-            "*Address Format:*\n"
-            "kaspa:qz7ulu4c25dh7fzec..."
-        )
-        await update.message.reply_text(help_text, parse_mode='Markdown')
+        await update.message.reply_text(HELP_TEXT, parse_mode='Markdown')
     
     async def add_wallet(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await self._ensure_loaded()
         chat_id = update.effective_chat.id
         if context.args and len(context.args) > 0:
             wallet_address = context.args[0].strip()
@@ -100,29 +425,49 @@ class KaspaBot:
             )
             return
         
-        if not wallet_address.startswith('kaspa:'):
+        if not is_valid_kaspa(wallet_address):
             await update.message.reply_text(
-                "❌ Invalid address format! Must start with 'kaspa:'"
+                "❌ Invalid address format! Expected a full 'kaspa:' address."
             )
             return
         
-        if chat_id not in self.wallets:
-            self.wallets[chat_id] = []
-        
-        if wallet_address in self.wallets[chat_id]:
+        if wallet_address in self.wallets.get(chat_id, ()):
             await update.message.reply_text(
                 f"⚠️ Wallet already monitored!\n`{wallet_address}`",
                 parse_mode='Markdown'
             )
             return
         
-        self.wallets[chat_id].append(wallet_address)
+        # Seed the seen-set before the pollers can see the address, or a poll
+        # during a slow bootstrap would report old history as new; concurrent
+        # adds of the same address share one seeding run
+        seeding = self._seeding.get(wallet_address)
+        if seeding is None and wallet_address not in self.notified_transactions:
+            self.notified_transactions[wallet_address] = OrderedDict()
+            seeding = asyncio.ensure_future(self.initialize_wallet_history(wallet_address))
+            self._seeding[wallet_address] = seeding
+            seeding.add_done_callback(lambda _: self._seeding.pop(wallet_address, None))
+        if seeding is not None and not await asyncio.shield(seeding):
+            # Without a seeded seen-set the first poll would replay old history
+            if wallet_address not in self.addr_to_chats:
+                self.notified_transactions.pop(wallet_address, None)
+            await update.message.reply_text(
+                "❌ Couldn't load this wallet's history right now. Please try again in a moment."
+            )
+            return
+        
+        # Insertion-ordered dict: O(1) membership, listed in the order added
+        self.wallets.setdefault(chat_id, {})[wallet_address] = None
+        self.addr_to_chats.setdefault(wallet_address, set()).add(chat_id)
         
-        if wallet_address not in self.notified_transactions:
-            self.notified_transactions[wallet_address] = set()
-            await self.initialize_wallet_history(wallet_address)
+        if self.ws is not None:
+            try:
+                await self._ws_subscribe([wallet_address])
+            except Exception as e:
+                # The listener resubscribes everything when it reconnects
+                logger.error("❌ Push subscribe error: %s", e)
         
-        self.save_wallets()
+        self.schedule_save()
         await update.message.reply_text(
             f"✅ *Wallet added successfully!*\n\n"
             f"Address: `{wallet_address}`\n\n"
@@ -131,20 +476,22 @@ class KaspaBot:
         )
     
     async def initialize_wallet_history(self, wallet_address):
+        # Returns False if the existing history could not be fetched
         try:
-            async with aiohttp.ClientSession() as session:
-                transactions = await self.check_transactions(session, wallet_address)
-                if transactions and isinstance(transactions, dict):
-                    tx_list = transactions.get('transactions', [])
-                    for tx in tx_list[:50]:
-                        tx_hash = tx.get('transactionId', '')
-                        if tx_hash:
-                            self.notified_transactions[wallet_address].add(tx_hash)
-                    logger.info(f"✅ Initialized {len(tx_list[:50])} existing transactions")
+            transactions = await self.check_transactions(wallet_address, limit=HISTORY_TX_LIMIT)
+            if not isinstance(transactions, list):
+                return False
+            keys = [tx_key(tx.id) for tx in islice(transactions, HISTORY_TX_LIMIT)]
+            # API lists newest first; insert oldest first to keep eviction order
+            self.notified_transactions[wallet_address].update(dict.fromkeys(reversed(keys)))
+            logger.info("✅ Initialized %s existing transactions", len(keys))
+            return True
         except Exception as e:
-            logger.error(f"Error initializing: {e}")
+            logger.error("Error initializing: %s", e)
+            return False
     
     async def list_wallets(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await self._ensure_loaded()
         chat_id = update.effective_chat.id
         if chat_id not in self.wallets or not self.wallets[chat_id]:
             await update.message.reply_text(
@@ -153,14 +500,18 @@ class KaspaBot:
             )
             return
         
-        wallets_list = "📋 *Your Monitored Wallets:*\n\n"
-        for idx, wallet in enumerate(self.wallets[chat_id], 1):
-            short_addr = f"{wallet[:15]}...{wallet[-10:]}"
-            wallets_list += f"{idx}. `{short_addr}`\n"
-        wallets_list += f"\n💡 Total: {len(self.wallets[chat_id])} wallet(s)"
+        lines = "\n".join(
+            f"{idx}. `{short_address(wallet)}`"
+            for idx, wallet in enumerate(self.wallets[chat_id], 1)
+        )
+        wallets_list = (
+            f"📋 *Your Monitored Wallets:*\n\n{lines}\n"
+            f"\n💡 Total: {len(self.wallets[chat_id])} wallet(s)"
+        )
         await update.message.reply_text(wallets_list, parse_mode='Markdown')
     
     async def remove_wallet(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await self._ensure_loaded()
         chat_id = update.effective_chat.id
         if chat_id not in self.wallets or not self.wallets[chat_id]:
             await update.message.reply_text("📭 You're not monitoring any wallets.")
@@ -175,8 +526,21 @@ class KaspaBot:
         
         wallet_address = context.args[0].strip()
         if wallet_address in self.wallets[chat_id]:
-            self.wallets[chat_id].remove(wallet_address)
-            self.save_wallets()
+            del self.wallets[chat_id][wallet_address]
+            chats = self.addr_to_chats.get(wallet_address, set())
+            chats.discard(chat_id)
+            if not chats:
+                self.addr_to_chats.pop(wallet_address, None)
+                self.next_check_at.pop(wallet_address, None)
+                self.idle_count.pop(wallet_address, None)
+                self.last_top_tx.pop(wallet_address, None)
+                self.etags.pop(wallet_address, None)
+                self._pending_etags.pop(wallet_address, None)
+                self._check_locks.pop(wallet_address, None)
+                # Free its seen-set too; re-adding it seeds history afresh
+                self.notified_transactions.pop(wallet_address, None)
+                self.last_checked.pop(wallet_address, None)
+            self.schedule_save()
             await update.message.reply_text(
                 f"✅ *Wallet removed!*\n\n`{wallet_address}`",
                 parse_mode='Markdown'
@@ -184,212 +548,428 @@ class KaspaBot:
         else:
             await update.message.reply_text("❌ Wallet not in your monitoring list.")
     
+    async def add_wallet_prompt(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await update.message.reply_text(
+            "📝 *Add a Kaspa Wallet*\n\nUse: /add <kaspa_address>",
+            parse_mode='Markdown'
+        )
+    
+    async def remove_wallet_prompt(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await update.message.reply_text(
+            "❌ *Remove a Wallet*\n\nUse: /remove <kaspa_address>",
+            parse_mode='Markdown'
+        )
+    
     async def handle_text(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         text = update.message.text
-        if text == "📝 Add Wallet":
-            await update.message.reply_text(
-                "📝 *Add a Kaspa Wallet*\n\nUse: /add <kaspa_address>",
-                parse_mode='Markdown'
-            )
-        elif text == "📋 List Wallets":
-            await self.list_wallets(update, context)
-        elif text == "❌ Remove Wallet":
-            await update.message.reply_text(
-                "❌ *Remove a Wallet*\n\nUse: /remove <kaspa_address>",
-                parse_mode='Markdown'
-            )
-        elif text == "ℹ️ Help":
-            await self.help_command(update, context)
-        elif text.startswith('kaspa:'):
+        handler = self._button_handlers.get(text)
+        if handler:
+            return await handler(update, context)
+        if text.startswith(_KASPA_PREFIX):
             context.args = [text]
             await self.add_wallet(update, context)
     
-    async def check_transactions(self, session: aiohttp.ClientSession, wallet_address: str):
-        try:
-            # CORRECT API ENDPOINT
-            url = f"{KASPA_API_BASE}/addresses/{wallet_address}/transactions"
+    async def check_transactions(self, wallet_address: str, limit: int = POLL_TX_LIMIT, join: bool = True):
+        # Poll, push and bootstrap can ask for the same address at once;
+        # callers share one in-flight request instead of each doing a GET.
+        # join=False always starts a new request: a push must not reuse a GET
+        # that began before the pushed transaction existed
+        key = (wallet_address, limit)
+        pending = self._inflight.get(key) if join else None
+        if pending is None:
+            pending = asyncio.ensure_future(self._fetch_transactions(wallet_address, limit))
+            self._inflight[key] = pending
             
-            async with session.get(url, timeout=15) as response:
-                if response.status == 200:
-                    data = await response.json()
-                    logger.info(f"✅ Fetched transactions for {wallet_address[:20]}...")
-                    return data
-                elif response.status == 404:
-                    logger.warning(f"⚠️ Wallet not found: {wallet_address[:20]}...")
-                    return None
-                else:
-                    logger.warning(f"⚠️ API status {response.status}")
-                    return None
-        except asyncio.TimeoutError:
-            logger.error(f"⏱️ Timeout")
-            return None
-        except Exception as e:
-            logger.error(f"❌ Error: {e}")
-            return None
+            def done(fut):
+                if self._inflight.get(key) is fut:
+                    del self._inflight[key]
+            pending.add_done_callback(done)
+        return await asyncio.shield(pending)
+    
+    async def _fetch_transactions(self, wallet_address, limit):
+        # CORRECT API ENDPOINT
+        url = f"{KASPA_API_BASE}/addresses/{wallet_address}/transactions"
+        # Only polls revalidate; seeding history must always get a full page
+        conditional = limit == POLL_TX_LIMIT
+        use_params = self.api_params_supported
+        probing = False
+        
+        for attempt in range(FETCH_ATTEMPTS):
+            # Only ask for the delta since the newest block time we processed
+            params = None
+            if use_params:
+                params = {'limit': limit}
+                if wallet_address in self.last_checked:
+                    params['after_time'] = self.last_checked[wallet_address]
+            etag = self.etags.get(wallet_address) if conditional else None
+            headers = {'If-None-Match': etag} if etag else None
+            
+            try:
+                async with self.session.get(url, params=params, headers=headers, timeout=REQ_TIMEOUT) as response:
+                    if params is not None and response.status in (400, 422):
+                        # A mistyped address gets a 400 too; only give up on
+                        # delta queries if the plain request then succeeds
+                        use_params = False
+                        probing = True
+                        continue
+                    elif response.status == 304:
+                        logger.info("ℹ️ Not modified: %s...", wallet_address[:20])
+                        return NOT_MODIFIED
+                    elif response.status == 200:
+                        if probing:
+                            logger.warning("⚠️ API rejected query params, falling back to full history")
+                            self.api_params_supported = False
+                        raw = await response.read()
+                        if len(raw) > JSON_OFFLOAD_BYTES:
+                            data = await asyncio.to_thread(decode_transactions, raw)
+                        else:
+                            data = decode_transactions(raw)
+                        if conditional and response.headers.get('ETag'):
+                            # Committed by process_transactions once the page is fully handled
+                            self._pending_etags[wallet_address] = response.headers['ETag']
+                        logger.info("✅ Fetched transactions for %s...", wallet_address[:20])
+                        return data
+                    elif response.status == 404:
+                        # Never-used addresses have no history yet, not a failure
+                        logger.warning("⚠️ Wallet not found: %s...", wallet_address[:20])
+                        return []
+                    
+                    logger.warning("⚠️ API status %s", response.status)
+                    # Only rate limiting and server errors are worth retrying
+                    if response.status != 429 and response.status < 500:
+                        return None
+            except asyncio.TimeoutError:
+                logger.error("⏱️ Timeout")
+            except aiohttp.ClientError as e:
+                logger.error("❌ Error: %s", e)
+            except Exception as e:
+                logger.error("❌ Error: %s", e)
+                return None
+            
+            if attempt < FETCH_ATTEMPTS - 1:
+                await asyncio.sleep(0.5 * 2 ** attempt + random.random())
+        return None
     
     async def monitor_wallets(self, application):
+        await self._ensure_loaded()
         logger.info("🚀 Starting wallet monitoring...")
-        logger.info(f"📡 Check interval: 30 seconds")
+        logger.info("📡 Check interval: %s-%s seconds", ACTIVE_POLL_INTERVAL, MAX_POLL_INTERVAL)
         
         while True:
             try:
-                if not self.wallets:
-                    await asyncio.sleep(30)
+                if not self.addr_to_chats:
+                    await asyncio.sleep(POLL_INTERVAL)
                     continue
                 
-                async with aiohttp.ClientSession() as session:
-                    for chat_id, wallets in list(self.wallets.items()):
-                        for wallet_address in wallets:
-                            logger.info(f"🔍 Checking: {wallet_address[:20]}...")
-                            
-                            transactions = await self.check_transactions(session, wallet_address)
-                            
-                            if transactions:
-                                await self.process_transactions(
-                                    application, chat_id, wallet_address, transactions
-                                )
-                            
-                            await asyncio.sleep(2)
+                now = time.monotonic()
+                due = [a for a in self.addr_to_chats if now >= self.next_check_at.get(a, 0)]
+                
+                # The API has no multi-address endpoint, so a cycle is one check
+                # per unique address, run concurrently on the shared pool
+                results = await asyncio.gather(*(
+                    self._check_one(application, wallet_address) for wallet_address in due
+                ), return_exceptions=True)
                 
-                logger.info("✅ Cycle complete. Waiting 30s...")
-                await asyncio.sleep(30)
+                now = time.monotonic()
+                for wallet_address, new_count in zip(due, results):
+                    if isinstance(new_count, Exception):
+                        logger.error("❌ Check error: %s", new_count)
+                        new_count = None
+                    if new_count is None:
+                        # Failed fetches are retried at the base interval
+                        self.next_check_at[wallet_address] = now + POLL_INTERVAL
+                    elif new_count:
+                        self.idle_count[wallet_address] = 0
+                        self.next_check_at[wallet_address] = now + ACTIVE_POLL_INTERVAL
+                    else:
+                        idle = self.idle_count.get(wallet_address, 0) + 1
+                        self.idle_count[wallet_address] = idle
+                        self.next_check_at[wallet_address] = now + min(
+                            POLL_INTERVAL * 2 ** min(idle - 1, 5), MAX_POLL_INTERVAL
+                        )
+                if self.ws is not None:
+                    # Pushes drive the fast checks; keep a slow safety-net poll
+                    # in case the stream is connected but never pushes
+                    for wallet_address in due:
+                        self.next_check_at[wallet_address] = now + MAX_POLL_INTERVAL
+                
+                # Sleep until the next wallet is due rather than a fixed cycle
+                next_due = min(
+                    (self.next_check_at.get(a, 0) for a in self.addr_to_chats),
+                    default=now + POLL_INTERVAL
+                )
+                wait = min(max(next_due - time.monotonic(), 1), POLL_INTERVAL)
+                logger.info("✅ Cycle complete (%s checked). Waiting %.0fs...", len(due), wait)
+                await asyncio.sleep(wait)
                 
             except Exception as e:
-                logger.error(f"❌ Monitor error: {e}")
+                logger.error("❌ Monitor error: %s", e)
                 await asyncio.sleep(60)
     
-    async def process_transactions(self, application, chat_id, wallet_address, transactions):
+    async def _ws_subscribe(self, addresses):
+        await self.ws.send_str(json_dumps_str({"op": "subscribe", "addresses": list(addresses)}))
+    
+    async def _ws_listener(self, application):
+        logger.info("📡 Connecting to push stream: %s", KASPA_WS_URL)
+        backoff = 1
+        
+        while True:
+            try:
+                async with self.session.ws_connect(KASPA_WS_URL, heartbeat=30) as ws:
+                    self.ws = ws
+                    backoff = 1
+                    await self._ws_subscribe(self.addr_to_chats)
+                    logger.info("✅ Push stream connected, polling slowed to every %ss", MAX_POLL_INTERVAL)
+                    
+                    async for msg in ws:
+                        if msg.type == aiohttp.WSMsgType.TEXT:
+                            # Handle pushes concurrently so a slow check doesn't
+                            # stall the read loop; _check_sem caps the fan-out
+                            task = asyncio.create_task(
+                                self._handle_ws_message(application, msg.data)
+                            )
+                            self._push_tasks.add(task)
+                            task.add_done_callback(self._push_tasks.discard)
+                        elif msg.type == aiohttp.WSMsgType.ERROR:
+                            break
+            except Exception as e:
+                logger.error("❌ Push stream error: %s", e)
+            finally:
+                if self.ws is not None:
+                    # Wallets were pushed out to the safety-net interval while
+                    # the stream was up; make them all due again right away
+                    self.next_check_at.clear()
+                self.ws = None
+            
+            logger.warning("⚠️ Push stream down, polling at normal rate. Retrying in %ss", backoff)
+            await asyncio.sleep(backoff)
+            backoff = min(backoff * 2, 300)
+    
+    async def _handle_ws_message(self, application, data):
+        # A bad frame is dropped on its own rather than taking the stream down
+        try:
+            message = json_loads(data)
+        except ValueError:
+            logger.warning("⚠️ Ignoring malformed push frame")
+            return
+        if not isinstance(message, dict):
+            return
+        
+        # Pushes are only a hint; the REST endpoint stays the source of truth
+        wallet_address = message.get('address')
+        if wallet_address in self.addr_to_chats:
+            try:
+                await self._check_one(application, wallet_address, fresh=True)
+            except Exception as e:
+                logger.error("❌ Push check error: %s", e)
+    
+    def _check_lock(self, wallet_address):
+        lock = self._check_locks.get(wallet_address)
+        if lock is None:
+            lock = self._check_locks[wallet_address] = asyncio.Lock()
+        return lock
+    
+    async def _check_one(self, application, wallet_address, fresh=False):
+        # Returns the delivered count, or None if the fetch failed. Poll and
+        # push checks of one address run one at a time from fetch to send,
+        # or both would see the same tx as new and notify it twice
+        async with self._check_lock(wallet_address):
+            async with self._check_sem:
+                logger.info("🔍 Checking: %s...", wallet_address[:20])
+                transactions = await self.check_transactions(wallet_address, join=not fresh)
+            
+            if transactions is None:
+                return None
+            return await self.process_transactions(
+                application, list(self.addr_to_chats.get(wallet_address, ())),
+                wallet_address, transactions
+            )
+    
+    async def process_transactions(self, application, chat_ids, wallet_address, transactions):
         try:
-            if not isinstance(transactions, dict):
-                return
+            if transactions is NOT_MODIFIED:
+                return 0
             
-            tx_list = transactions.get('transactions', [])
+            tx_list = transactions[:POLL_TX_LIMIT]
             if not tx_list:
-                logger.info(f"ℹ️ No transactions found")
-                return
+                self._commit_etag(wallet_address)
+                logger.info("ℹ️ No transactions found")
+                return 0
             
-            logger.info(f"📊 Found {len(tx_list)} transactions")
-            new_count = 0
+            # Same newest tx as the last fully handled poll: nothing to do
+            top = tx_list[0].id
+            if top == self.last_top_tx.get(wallet_address):
+                self._commit_etag(wallet_address)
+                logger.info("ℹ️ No new transactions")
+                return 0
             
-            for tx in tx_list[:20]:
-                if not isinstance(tx, dict):
-                    continue
-                
-                tx_hash = tx.get('transactionId', '')
-                if not tx_hash or self.is_transaction_notified(wallet_address, tx_hash):
-                    continue
-                
-                logger.info(f"🆕 NEW transaction: {tx_hash[:16]}...")
-                
-                success = await self.send_transaction_notification(
-                    application, chat_id, wallet_address, tx
-                )
-                
-                if success:
+            logger.info("📊 Found %s transactions", len(tx_list))
+            new_txs = [
+                tx for tx in tx_list
+                if not self.is_transaction_notified(wallet_address, tx.id)
+            ]
+            for tx in new_txs:
+                logger.info("🆕 NEW transaction: %s...", tx.id[:16])
+            
+            items = []
+            for tx in new_txs:
+                message = self.format_transaction(wallet_address, tx)
+                if message:
+                    items.append((tx.id, message))
+                else:
+                    # Unformattable now means unformattable forever; stop retrying it
+                    self.mark_transaction_notified(wallet_address, tx.id)
+            
+            # One batched message per chat; _wait_send_slot keeps the overall rate in check
+            delivered = set().union(*await asyncio.gather(*(
+                self.send_batched_notification(chat_id, items) for chat_id in chat_ids
+            )))
+            
+            new_count = 0
+            for tx_hash, _ in items:
+                if tx_hash in delivered:
                     self.mark_transaction_notified(wallet_address, tx_hash)
                     new_count += 1
-                    await asyncio.sleep(0.5)
+            
+            # Advance the cursor only once nothing is left pending for a retry
+            if new_count == len(items):
+                self.last_checked[wallet_address] = max(
+                    self.last_checked.get(wallet_address, 0), *(tx.block_time for tx in tx_list)
+                )
+                self.last_top_tx[wallet_address] = top
+                self._commit_etag(wallet_address)
+            else:
+                # Keep revalidating against the last fully handled page, so the
+                # next poll gets a 200 and retries what was not delivered
+                self._pending_etags.pop(wallet_address, None)
             
             if new_count > 0:
-                logger.info(f"✅ Sent {new_count} notifications")
+                logger.info("✅ Sent %s notifications", new_count)
             else:
-                logger.info(f"ℹ️ No new transactions")
+                logger.info("ℹ️ No new transactions")
+            # Only delivered notifications count as activity for the poll backoff
+            return new_count
                 
         except Exception as e:
-            logger.error(f"❌ Process error: {e}")
+            logger.error("❌ Process error: %s", e)
+            return 0
+    
+    def _commit_etag(self, wallet_address):
+        # Only a fully handled page may be revalidated with If-None-Match
+        etag = self._pending_etags.pop(wallet_address, None)
+        if etag:
+            self.etags[wallet_address] = etag
+    
+    async def _wait_send_slot(self):
+        # Reserve the next free send slot synchronously, then sleep until it
+        now = time.monotonic()
+        slot = max(now, self._tg_next_slot)
+        self._tg_next_slot = slot + 1 / TELEGRAM_MAX_MSG_PER_SEC
+        if slot > now:
+            await asyncio.sleep(slot - now)
     
-    async def send_transaction_notification(self, application, chat_id, wallet_address, transaction):
+    def format_transaction(self, wallet_address, tx):
         try:
-            if not isinstance(transaction, dict):
-                return False
-            
-            tx_hash = transaction.get('transactionId', 'Unknown')
-            block_time = transaction.get('blockTime', 0)
-            
-            inputs = transaction.get('inputs', []) or []
-            outputs = transaction.get('outputs', []) or []
-            
-            if not outputs:
-                return False
-            
-            # Determine direction
-            is_incoming = False
-            amount = 0
-            from_address = "Unknown"
-            to_address = "Unknown"
-            
-            for output in outputs:
-                if not isinstance(output, dict):
-                    continue
-                output_addr = output.get('address', '')
-                if output_addr == wallet_address:
-                    is_incoming = True
-                    prev_out = output.get('previousOutput', {})
-                    amount += int(prev_out.get('amount', 0))
-                    to_address = wallet_address
-                    if inputs and isinstance(inputs[0], dict):
-                        prev = inputs[0].get('previousOutput', {})
-                        from_address = prev.get('address', 'Unknown')
-            
-            if not is_incoming and inputs:
-                for inp in inputs:
-                    if not isinstance(inp, dict):
-                        continue
-                    prev = inp.get('previousOutput', {})
-                    if prev.get('address') == wallet_address:
-                        from_address = wallet_address
-                        if outputs and isinstance(outputs[0], dict):
-                            to_address = outputs[0].get('address', 'Unknown')
-                            for out in outputs:
-                                if isinstance(out, dict):
-                                    prev_out = out.get('previousOutput', {})
-                                    amount += int(prev_out.get('amount', 0))
-                        break
-            
-            # Convert from sompi to KAS
-            amount_kas = amount / 100_000_000
-            
-            # Format timestamp
-            tx_time = datetime.fromtimestamp(block_time / 1000).strftime('%Y-%m-%d %H:%M:%S')
+            if not tx.outputs:
+                return None
             
-            explorer_link = f"{KASPA_EXPLORER_URL}/txs/{tx_hash}"
-            
-            from_short = f"{from_address[:15]}...{from_address[-10:]}" if len(from_address) > 30 else from_address
-            to_short = f"{to_address[:15]}...{to_address[-10:]}" if len(to_address) > 30 else to_address
-            tx_short = f"{tx_hash[:16]}..."
-            
-            direction = "📥 Incoming" if is_incoming else "📤 Outgoing"
-            message = (
-                f"🔔 *{direction} Transaction!*\n\n"
-                f"💰 *Amount:* `{amount_kas:.8f}` KAS\n"
-                f"⏰ *Time:* {tx_time}\n"
-                f"📤 *From:* `{from_short}`\n"
-                f"📥 *To:* `{to_short}`\n"
-                f"🔗 *TX:* `{tx_short}`\n\n"
-                f"[View on Explorer]({explorer_link})"
+            is_incoming, amount, from_address, to_address = classify_tx(tx, wallet_address)
+
+            tmpl = _INCOMING_TMPL if is_incoming else _OUTGOING_TMPL
+            return tmpl.format(
+                amount_kas=amount / SOMPI_PER_KAS,
+                tx_time=time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(tx.block_time // 1000)),
+                from_short=short_address(from_address),
+                to_short=short_address(to_address),
+                tx_prefix=tx.id[:16],
+                tx_hash=tx.id
             )
+        except Exception as e:
+            logger.error("❌ Format error: %s", e)
+            return None
+    
+    async def send_batched_notification(self, chat_id, items):
+        # items are (tx_hash, message) pairs; returns the hashes delivered
+        # Pack as many snippets per message as fit, rather than truncating
+        # Markdown mid-entity or falling back to one message per tx
+        chunks = []
+        hashes, parts, size = [], [], 0
+        for tx_hash, message in items:
+            extra = len(message) + (len(NOTIFICATION_SEPARATOR) if parts else 0)
+            if parts and size + extra > TELEGRAM_MAX_MESSAGE_LEN:
+                chunks.append((hashes, NOTIFICATION_SEPARATOR.join(parts)))
+                hashes, parts, size = [], [], 0
+                extra = len(message)
+            hashes.append(tx_hash)
+            parts.append(message)
+            size += extra
+        if parts:
+            chunks.append((hashes, NOTIFICATION_SEPARATOR.join(parts)))
+        
+        results = await asyncio.gather(*(self.send_message(chat_id, text) for _, text in chunks))
+        return {h for (chunk_hashes, _), ok in zip(chunks, results) if ok for h in chunk_hashes}
+    
+    async def send_message(self, chat_id, text):
+        try:
+            # Notifications go straight to the Bot API over the pooled session;
+            # PTB's request machinery is kept for command replies
+            await self._wait_send_slot()
+            async with self.session.post(self._tg_url, timeout=REQ_TIMEOUT, json={
+                "chat_id": chat_id,
+                "text": text,
+                "parse_mode": "Markdown",
+                "disable_web_page_preview": True
+            }) as response:
+                result = json_loads(await response.read())
             
-            await application.bot.send_message(
-                chat_id=chat_id,
-                text=message,
-                parse_mode='Markdown',
-                disable_web_page_preview=True
-            )
+            if not result.get('ok'):
+                logger.warning("⚠️ Telegram rejected notification for chat %s: %s",
+                               chat_id, result.get('description'))
+                return False
             
-            logger.info(f"✅ Sent notification to chat {chat_id}")
+            logger.info("✅ Sent notification to chat %s", chat_id)
             return True
             
         except Exception as e:
-            logger.error(f"❌ Notification error: {e}")
+            logger.error("❌ Notification error: %s", e)
             return False
 
 async def post_init(application):
-    asyncio.create_task(bot_instance.monitor_wallets(application))
+    await bot_instance._ensure_loaded()
+    bot_instance.session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(
+            limit=20, limit_per_host=MAX_CONCURRENT_CHECKS,
+            keepalive_timeout=75, ttl_dns_cache=300
+        ),
+        json_serialize=json_dumps_str
+    )
+    # Keep references so the background tasks can't be garbage collected
+    bot_instance._tasks.append(asyncio.create_task(bot_instance._flusher()))
+    bot_instance._tasks.append(asyncio.create_task(bot_instance.monitor_wallets(application)))
+    if KASPA_WS_URL:
+        bot_instance._tasks.append(asyncio.create_task(bot_instance._ws_listener(application)))
+
+async def post_shutdown(application):
+    # Stop the pollers before the session they use goes away
+    tasks = [*bot_instance._tasks, *bot_instance._push_tasks]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    if bot_instance.should_save_on_shutdown():
+        bot_instance.save_wallets()
+    if bot_instance.session:
+        await bot_instance.session.close()
 
 bot_instance = None
 
 def main():
     global bot_instance
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass  # e.g. on Windows; the default asyncio loop works fine
+    
     TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
     
     if not TOKEN:
@@ -401,7 +981,17 @@ def main():
     logger.info("=" * 60)
     
     bot_instance = KaspaBot(TOKEN)
-    application = Application.builder().token(TOKEN).post_init(post_init).build()
+    application = (
+        Application.builder()
+        .token(TOKEN)
+        .concurrent_updates(True)
+        .connection_pool_size(64)
+        .pool_timeout(10.0)
+        .connect_timeout(5.0)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .build()
+    )
     
     application.add_handler(CommandHandler("start", bot_instance.start))
     application.add_handler(CommandHandler("help", bot_instance.help_command))
@@ -413,7 +1003,20 @@ def main():
     logger.info("✅ Bot initialized")
     logger.info("📡 Ready to monitor")
     logger.info("=" * 60)
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    
+    webhook_url = os.getenv('WEBHOOK_URL')
+    if webhook_url:
+        # Push-based updates; Railway exposes the listening port via $PORT
+        logger.info("🌐 Using webhook: %s", webhook_url)
+        application.run_webhook(
+            listen='0.0.0.0',
+            port=int(os.getenv('PORT', '8443')),
+            url_path=TOKEN,
+            webhook_url=f"{webhook_url.rstrip('/')}/{TOKEN}",
+            allowed_updates=Update.ALL_TYPES
+        )
+    else:
+        application.run_polling(allowed_updates=Update.ALL_TYPES)
 
 if __name__ == '__main__':
     main()